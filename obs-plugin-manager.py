@@ -1,19 +1,109 @@
 #!/usr/bin/python
+import io
 import os
 import re
+import sys
+import gzip
 import json
+import socket
+import shutil
+import hashlib
+import tarfile
+import zipfile
+import mmap
+import math
 import time
+import heapq
+import array
+import random
+import struct
+import operator
+import functools
+import threading
+import http.client
+import email.utils
 import fnmatch
 import platform
+import atexit
 import argparse
+import socketserver
+import tempfile
+import contextlib
 from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from html.parser import HTMLParser
-from urllib import request
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from urllib import request, parse, error
+try:
+    import fcntl # advisory file locks, not available on windows
+except ImportError:
+    fcntl = None
+
+NUMBER_OPERATORS = {">": operator.gt, "<": operator.lt, ">=": operator.ge, "<=": operator.le, "!=": operator.ne, "==": operator.eq}
 
 #CONFIG_DIR = os.path.expanduser("~/.config/obs-plugin-pm")
 #PLUGINS_DIR = os.path.expanduser("~/.config/obs-studio/plugins/")
 #INSTALLED_PLUGINS_FILE = os.path.join(CONFIG_DIR, "installed_plugins.json")
 
+class Instrumentation: # optional timing and io counters for --timings / --trace
+    def __init__(self):
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self.events = [] # finished spans, (name, start, duration, thread id, args)
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.null_span = contextlib.nullcontext()
+
+    def enable(self):
+        self.enabled = True
+        self.origin = time.perf_counter()
+
+    def span(self, name, **args):
+        if not self.enabled: # keep the disabled path to one attribute check
+            return self.null_span
+        return self.timed(name, args)
+
+    @contextlib.contextmanager
+    def timed(self, name, args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append((name, start - self.origin, time.perf_counter() - start, threading.get_ident(), args))
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def print_summary(self):
+        phases = {}
+        for name, _, duration, _, _ in self.events:
+            phase = phases.setdefault(name, [0, 0.0, 0.0])
+            phase[0] += 1
+            phase[1] += duration
+            phase[2] = max(phase[2], duration)
+        print("")
+        print("--- Timings ---")
+        print(f"total: {(time.perf_counter() - self.origin) * 1000:.2f}ms")
+        for name, (calls, total, longest) in sorted(phases.items(), key=lambda item: item[1][1], reverse=True):
+            print(f"{name}: {total * 1000:.2f}ms in {calls} calls (max {longest * 1000:.2f}ms)")
+        for name, amount in sorted(self.counters.items()):
+            print(f"{name}: {amount}")
+
+    def write_trace(self, filepath): # chrome trace event format, opens in perfetto or about:tracing
+        pid = os.getpid()
+        trace = {"traceEvents": [], "otherData": {"counters": self.counters}}
+        for name, start, duration, tid, args in self.events:
+            trace["traceEvents"].append({"name": name, "ph": "X", "ts": start * 1e6, "dur": duration * 1e6, "pid": pid, "tid": tid, "args": args})
+        with open(filepath, 'w') as f:
+            json.dump(trace, f)
+
+
+TRACE = Instrumentation()
+
+
 class OSManager: # Get corect read only values for the active os
     def __init__(self):
         self.system = platform.system()
@@ -35,23 +125,398 @@ class OSManager: # Get corect read only values for the active os
         return os.path.join(self.data_base(), "obs-studio", "plugins")
 
 
+class CatalogSnapshot(Mapping): # read only, mmap backed view of the online plugin catalog
+    # Layout, all integers little endian:
+    #   header   magic, format version, stamp, plugin count and section offsets
+    #   fields   json list of [field name, column typecode or null], records refer to fields by index
+    #   ids      json list of plugin ids, in record order
+    #   columns  one packed array per numeric field (int64 or double), count values each
+    #   index    count + 1 record offsets (uint64) into the records section
+    #   records  one json list of [field index, value] pairs per plugin, column fields are just [field index]
+    #   lookup   sorted lowercase string values with (record, field) postings for exact matching
+    MAGIC = b"OPMC"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHHQII6Q")
+    INT_NONE = -(2 ** 63) # None marker for int columns, float columns use nan
+    LOOKUP_FIELDS = ("name", "id") # pseudo fields split from the url slug
+
+    def __init__(self, path, stamp=None):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, _, self.stamp, self._count, _,
+             fields_off, ids_off, columns_off, index_off, records_off, lookup_off) = self.HEADER.unpack_from(self._mm, 0)
+            if magic != self.MAGIC or version != self.VERSION:
+                raise ValueError(f"{path} is not a version {self.VERSION} catalog snapshot")
+            if stamp is not None and stamp != self.stamp:
+                raise ValueError(f"{path} is outdated")
+            self._fields = json.loads(self._mm[fields_off:ids_off].rstrip(b"\0"))
+            self._ids = json.loads(self._mm[ids_off:columns_off].rstrip(b"\0"))
+            self._id_index = {plugin_id: idx for idx, plugin_id in enumerate(self._ids)}
+            self._columns = {}
+            offset = columns_off
+            for name, typecode in self._fields:
+                if typecode:
+                    self._columns[name] = (typecode, offset)
+                    offset += 8 * self._count
+            self._index_off = index_off
+            self._records_off = records_off
+            self._lookup_off = lookup_off
+        except Exception:
+            self._mm.close()
+            raise
+
+    def close(self):
+        self._mm.close()
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __contains__(self, plugin_id):
+        return plugin_id in self._id_index
+
+    def __getitem__(self, plugin_id):
+        return self.record(self._id_index[plugin_id])
+
+    def record(self, idx): # decode a single plugin, nothing else is touched
+        start, end = struct.unpack_from("<QQ", self._mm, self._index_off + 8 * idx)
+        pairs = json.loads(self._mm[self._records_off + start:self._records_off + end])
+        plugin = {}
+        for pair in pairs:
+            name = self._fields[pair[0]][0]
+            if len(pair) > 1:
+                plugin[name] = pair[1]
+            else:
+                plugin[name] = self.column_value(name, idx)
+        return plugin
+
+    def column_value(self, name, idx):
+        typecode, offset = self._columns[name]
+        value, = struct.unpack_from("<" + typecode, self._mm, offset + 8 * idx)
+        if typecode == "q":
+            return None if value == self.INT_NONE else value
+        return None if value != value else value
+
+    def column(self, name): # whole numeric column as a list, None where unset
+        if name not in self._columns:
+            return None
+        typecode, offset = self._columns[name]
+        values = array.array(typecode, self._mm[offset:offset + 8 * self._count])
+        if sys.byteorder == "big":
+            values.byteswap()
+        if typecode == "q":
+            return [None if value == self.INT_NONE else value for value in values]
+        return [None if value != value else value for value in values]
+
+    def lookup(self, key): # (plugin id, field) pairs whose string value equals key
+        base = self._lookup_off
+        nkeys, = struct.unpack_from("<Q", self._mm, base)
+        key_offs = base + 8
+        post_offs = key_offs + 8 * (nkeys + 1)
+        key_blob = post_offs + 8 * (nkeys + 1)
+        key_end, = struct.unpack_from("<Q", self._mm, key_offs + 8 * nkeys)
+        post_blob = key_blob + key_end
+        target = key.encode()
+
+        lo, hi = 0, nkeys
+        while lo < hi: # binary search over the sorted keys
+            mid = (lo + hi) // 2
+            start, end = struct.unpack_from("<QQ", self._mm, key_offs + 8 * mid)
+            if self._mm[key_blob + start:key_blob + end] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == nkeys:
+            return []
+        start, end = struct.unpack_from("<QQ", self._mm, key_offs + 8 * lo)
+        if self._mm[key_blob + start:key_blob + end] != target:
+            return []
+        start, end = struct.unpack_from("<QQ", self._mm, post_offs + 8 * lo)
+        found = []
+        for pos in range(post_blob + start, post_blob + end, 8):
+            idx, field = struct.unpack_from("<II", self._mm, pos)
+            found.append((self._ids[idx], self._fields[field][0]))
+        return found
+
+    @classmethod
+    def write(cls, path, plugins, stamp):
+        ids = ["null" if plugin_id is None else str(plugin_id) for plugin_id in plugins] # same keys json would give
+        records = list(plugins.values())
+
+        # interned field names, numeric fields present in every record become columns
+        field_names = []
+        for plugin in records:
+            for name in plugin:
+                if name not in field_names:
+                    field_names.append(name)
+        fields = []
+        for name in field_names:
+            typecode = None
+            values = [plugin.get(name) for plugin in records]
+            if all(name in plugin for plugin in records) and all(value is None or (isinstance(value, (int, float)) and not isinstance(value, bool)) for value in values):
+                ints = all(value is None or isinstance(value, int) for value in values)
+                if not ints or all(value is None or abs(value) < 2 ** 63 - 1 for value in values):
+                    typecode = "q" if ints else "d"
+            fields.append([name, typecode])
+        for name in cls.LOOKUP_FIELDS:
+            if name not in field_names:
+                fields.append([name, None])
+        field_idx = {name: idx for idx, (name, _) in enumerate(fields)}
+
+        columns = b""
+        for name, typecode in fields:
+            if typecode:
+                none = cls.INT_NONE if typecode == "q" else float("nan")
+                values = array.array(typecode, [none if plugin[name] is None else plugin[name] for plugin in records])
+                if sys.byteorder == "big":
+                    values.byteswap()
+                columns += values.tobytes()
+
+        index = [0]
+        record_blob = []
+        postings = {}
+        size = 0
+        for idx, plugin in enumerate(records):
+            pairs = []
+            for name, value in plugin.items():
+                if fields[field_idx[name]][1]:
+                    pairs.append([field_idx[name]])
+                else:
+                    pairs.append([field_idx[name], value])
+                if isinstance(value, str):
+                    if name == "url":
+                        parts = value.split("/")
+                        if len(parts) < 2:
+                            continue
+                        value = parts[-2]
+                        special = value.split(".")
+                        postings.setdefault(".".join(special[:-1]).lower(), []).append((idx, field_idx["name"]))
+                        postings.setdefault(special[-1].lower(), []).append((idx, field_idx["id"]))
+                    postings.setdefault(value.lower(), []).append((idx, field_idx[name]))
+            encoded = json.dumps(pairs, separators=(",", ":")).encode()
+            record_blob.append(encoded)
+            size += len(encoded)
+            index.append(size)
+
+        keys = sorted((key.encode(), entries) for key, entries in postings.items())
+        key_offs, post_offs = [0], [0]
+        key_blob, post_blob = [], []
+        for key, entries in keys:
+            key_blob.append(key)
+            key_offs.append(key_offs[-1] + len(key))
+            post_blob.append(b"".join(struct.pack("<II", idx, field) for idx, field in entries))
+            post_offs.append(post_offs[-1] + 8 * len(entries))
+        lookup = struct.pack(f"<Q{len(keys) + 1}Q{len(keys) + 1}Q", len(keys), *key_offs, *post_offs) + b"".join(key_blob) + b"".join(post_blob)
+
+        def pad(blob): # keep every section 8 byte aligned
+            return blob + b"\0" * (-len(blob) % 8)
+
+        sections = [
+            pad(json.dumps(fields, separators=(",", ":")).encode()),
+            pad(json.dumps(ids, separators=(",", ":")).encode()),
+            columns,
+            pad(struct.pack(f"<{len(index)}Q", *index)),
+            pad(b"".join(record_blob)),
+            lookup,
+        ]
+        offsets = []
+        offset = cls.HEADER.size
+        for section in sections:
+            offsets.append(offset)
+            offset += len(section)
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, 0, stamp, len(records), len(fields), *offsets)
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header)
+                for section in sections:
+                    f.write(section)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+
+
+class RequestScheduler: # rate limited and retrying access to remote hosts, shared by all requests
+    RETRY_CODES = (408, 425, 429, 500, 502, 503, 504)
+
+    def __init__(self, rate=2.0, burst=4, retries=5, timeout=30, concurrency=4, base_delay=1.0, max_delay=120.0):
+        self.rate = float(rate) # requests per second and host, the ceiling the buckets recover to
+        self.burst = float(burst)
+        self.retries = int(retries)
+        self.timeout = timeout
+        self.max_concurrency = max(1, int(concurrency))
+        self.concurrency = 1 # grows additively while the host keeps up, halves on errors
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.buckets = {} # host -> [tokens, last refill, current rate, blocked until]
+        self.latency = None # moving average of successful request times
+        self.min_latency = None
+        self.successes = 0
+        self.active = 0
+        self.lock = threading.Lock()
+        self.slots = threading.Condition(self.lock)
+
+    def wait_for_token(self, host):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                bucket = self.buckets.setdefault(host, [self.burst, now, self.rate, 0.0])
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * bucket[2])
+                bucket[1] = now
+                if now < bucket[3]: # the server asked us to back off
+                    wait = bucket[3] - now
+                elif bucket[0] >= 1:
+                    bucket[0] -= 1
+                    return
+                else:
+                    wait = (1 - bucket[0]) / bucket[2]
+            time.sleep(wait)
+
+    @contextlib.contextmanager
+    def slot(self):
+        with self.slots:
+            while self.active >= self.concurrency:
+                self.slots.wait()
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self.slots:
+                self.active -= 1
+                self.slots.notify_all()
+
+    def record_success(self, host, elapsed):
+        with self.lock:
+            self.min_latency = elapsed if self.min_latency is None else min(self.min_latency, elapsed)
+            self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+            bucket = self.buckets[host]
+            bucket[2] = min(self.rate, bucket[2] * 1.1) # recover slowly after a throttle
+            if self.latency > 3 * self.min_latency: # the host is slowing down, back off a little
+                self.concurrency = max(1, self.concurrency - 1)
+                self.successes = 0
+                return
+            self.successes += 1
+            if self.successes >= self.concurrency and self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+                self.successes = 0
+                self.slots.notify_all()
+
+    def record_error(self, host, throttled=False, retry_after=None):
+        with self.lock:
+            self.concurrency = max(1, self.concurrency // 2)
+            self.successes = 0
+            bucket = self.buckets[host]
+            if throttled:
+                bucket[2] = max(self.rate / 16, bucket[2] / 2)
+            if retry_after:
+                bucket[3] = max(bucket[3], time.monotonic() + retry_after)
+
+    def retry_after(self, headers):
+        value = headers.get("Retry-After") if headers else None
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, when.timestamp() - time.time())
+
+    def backoff(self, attempt): # exponential backoff with full jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def fetch(self, url, read=True):
+        # Returns (body, final url), body is None if read is False.
+        # Raises the last error once the retries are used up.
+        host = parse.urlsplit(url).netloc
+        for attempt in range(self.retries + 1):
+            self.wait_for_token(host)
+            with self.slot(), TRACE.span("request", url=url):
+                start = time.monotonic()
+                TRACE.count("requests")
+                try:
+                    with request.urlopen(url, timeout=self.timeout) as response:
+                        data = response.read() if read else None
+                        final_url = response.geturl()
+                        TRACE.count("bytes downloaded", len(data) if data else 0)
+                except error.HTTPError as e:
+                    if e.code not in self.RETRY_CODES or attempt == self.retries:
+                        raise
+                    wait = self.retry_after(e.headers)
+                    self.record_error(host, e.code == 429, wait)
+                    reason = f"HTTP {e.code}"
+                except (error.URLError, http.client.HTTPException, OSError) as e:
+                    if attempt == self.retries:
+                        raise
+                    wait = None
+                    self.record_error(host)
+                    reason = str(e)
+                else:
+                    self.record_success(host, time.monotonic() - start)
+                    return data, final_url
+            delay = wait if wait is not None else self.backoff(attempt)
+            TRACE.count("request retries")
+            print(f"Request to {url} failed ({reason}), retry {attempt + 1}/{self.retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+    def map(self, func, items): # run func over items in parallel, the slots limit how many hit the network
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            return list(executor.map(func, items))
+
+
 class ConfigManager: # manage the config json files
+    # settings with a property setter, their defaults are saved on first run
+    SAVED_DEFAULTS = {
+        "user_plugins_path": "",
+        "platforms_file_url": "https://codeberg.org/marvin1099/OBS-Plugin-Manager/raw/branch/data/obs-plugin-platforms.json",
+        "platform_cache_time": 0,
+        "plugin_forum_url": "https://obsproject.com",
+        "plugin_forum_page_request": "/forum/plugins/?page=",
+        "plugin_soft_cache_time": 0,
+        "plugin_cache_time": 0,
+        "catalog_mirror_url": "",
+    }
+
     def __init__(self, config_path, plugins_path):
         self.config_path = config_path
         self.plugins_path = plugins_path
         self.config_file = "obs-plugin-manager.json"
+        self._held_locks = {} # lock file path -> [fd, depth, exclusive]
+        self._catalog = None # last opened CatalogSnapshot
+        self._catalog_signature = None # config files state the catalog was looked up at
 
         config = self.plugins_config
-        self.user_plugins_path = config.get("user_plugins_path","")
-        self.platforms_file_url = config.get("platforms_file_url","https://codeberg.org/marvin1099/OBS-Plugin-Manager/raw/branch/data/obs-plugin-platforms.json")
+        self.journal_compact_size = config.get("journal_compact_size",8192) # compact once the journal is larger than this and the snapshot
         self.platform_refresh_time = config.get("platform_refresh_time",86400)
-        self.platform_cache_time = config.get("platform_cache_time",0)
-        self.plugin_forum_url = config.get("plugin_forum_url","https://obsproject.com")
-        self.plugin_forum_page_request = config.get("plugin_forum_page_request","/forum/plugins/?page=")
         self.plugin_soft_refresh_time = config.get("plugin_soft_refresh_time",86400)
-        self.plugin_soft_cache_time = config.get("plugin_soft_cache_time",0)
         self.plugin_refresh_time = config.get("plugin_refresh_time",604800)
-        self.plugin_cache_time = config.get("plugin_cache_time",0)
+        self.snapshot_keep = config.get("snapshot_keep",3)
+        self.snapshot_max_age = config.get("snapshot_max_age",2592000)
+        for key, default in self.SAVED_DEFAULTS.items(): # values are stored as read, no need to save them again
+            setattr(self, "_" + key, config.get(key, default))
+        missing = {key: default for key, default in self.SAVED_DEFAULTS.items() if key not in config}
+        if missing: # only the first run writes the defaults
+            self.plugins_config = missing
+        self.scheduler = RequestScheduler(
+            config.get("request_rate",2.0),
+            config.get("request_burst",4),
+            config.get("request_retries",5),
+            config.get("request_timeout",30),
+            config.get("request_concurrency",4))
 
     @property
     def config_file(self):
@@ -68,6 +533,42 @@ class ConfigManager: # manage the config json files
         else:
             self._config_file = os.path.join(self.config_path, file_path)
 
+    def reload(self): # pick up values other processes saved, without writing them back
+        config = self.plugins_config
+        self.journal_compact_size = config.get("journal_compact_size",self.journal_compact_size)
+        self.platform_refresh_time = config.get("platform_refresh_time",self.platform_refresh_time)
+        self.plugin_soft_refresh_time = config.get("plugin_soft_refresh_time",self.plugin_soft_refresh_time)
+        self.plugin_refresh_time = config.get("plugin_refresh_time",self.plugin_refresh_time)
+        for key in self.SAVED_DEFAULTS:
+            setattr(self, "_" + key, config.get(key, getattr(self, "_" + key)))
+        self.snapshot_keep = config.get("snapshot_keep",self.snapshot_keep)
+        self.snapshot_max_age = config.get("snapshot_max_age",self.snapshot_max_age)
+
+    def config_signature(self): # changes whenever the snapshot or the journal is written
+        signature = []
+        for filepath in (self.config_file, self.journal_file):
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                signature.append(None)
+            else:
+                signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    @property
+    def daemon_socket(self): # unix socket of a running --serve daemon for this config
+        return self.config_file + ".sock"
+
+    @property
+    def journal_file(self): # append only change log next to the config snapshot
+        return self.config_file + ".journal"
+
+    def catalog_file(self, stamp): # binary snapshot of online_cached_plugins
+        return f"{self.config_file}.catalog.{stamp}"
+
+    def search_index_file(self, stamp): # search index built from the snapshot with the same stamp
+        return f"{self.catalog_file(stamp)}.search"
+
     @property
     def user_plugins_path(self):
         path = self._user_plugins_path
@@ -84,6 +585,37 @@ class ConfigManager: # manage the config json files
             self._user_plugins_path = path
         self.plugins_config = {"user_plugins_path": self._user_plugins_path}
 
+    @property
+    def download_cache_path(self): # archives shared by all install targets
+        return os.path.join(self.config_path, "downloads")
+
+    @property
+    def install_targets(self): # extra plugin dirs by name, eg portable obs installs
+        return self.plugins_config.get("install_targets",{})
+
+    @install_targets.setter
+    def install_targets(self, targets):
+        self.plugins_config = {"install_targets": targets}
+
+    @install_targets.deleter
+    def install_targets(self, deletion_path=[]):
+        deleter = self.__class__.plugins_config.fdel
+        deleter(self, ["install_targets"] + deletion_path)
+
+    def install_paths(self, names=None):
+        # Absolute plugin dirs by target name, "default" is user_plugins_path
+        paths = {"default": self.user_plugins_path}
+        for name, path in self.install_targets.items():
+            paths[name] = path if os.path.isabs(path) else os.path.join(self.plugins_path, path)
+        if names is None:
+            return {"default": paths["default"]}
+        if "all" in names:
+            return paths
+        for name in names:
+            if name not in paths:
+                print(f"Unknown install target {name}, known targets are {', '.join(paths)}")
+        return {name: path for name, path in paths.items() if name in names}
+
     @property
     def platforms_file_url(self):
         return self._platforms_file_url
@@ -102,6 +634,23 @@ class ConfigManager: # manage the config json files
         self._plugin_forum_url = url
         self.plugins_config = {"plugin_forum_url": url}
 
+    @property
+    def catalog_mirror_url(self): # local path or http base url of a catalog mirror, empty to scrape the forum
+        return self._catalog_mirror_url
+
+    @catalog_mirror_url.setter
+    def catalog_mirror_url(self, url):
+        self._catalog_mirror_url = url
+        self.plugins_config = {"catalog_mirror_url": url}
+
+    @property
+    def catalog_mirror_version(self):
+        return self.plugins_config.get("catalog_mirror_version",{})
+
+    @catalog_mirror_version.setter
+    def catalog_mirror_version(self, version):
+        self.plugins_config = {"catalog_mirror_version": version}
+
     @property
     def plugin_forum_page_request(self):
         return self._plugin_forum_page_request
@@ -111,16 +660,73 @@ class ConfigManager: # manage the config json files
         self._plugin_forum_page_request = url
         self.plugins_config = {"plugin_forum_page_request": url}
 
+    @contextlib.contextmanager
+    def file_lock(self, filepath, exclusive=False):
+        # Reader/writer lock on a sidecar ".lock" file, reentrant per process
+        # so a setter holding the write lock can still call load_json
+        if fcntl is None:
+            yield
+            return
+        lock_path = filepath + ".lock"
+        held = self._held_locks.get(lock_path)
+        if held:
+            if exclusive and not held[2]:
+                fcntl.flock(held[0], fcntl.LOCK_EX) # upgrade shared to exclusive
+                held[2] = True
+            held[1] += 1
+            try:
+                yield
+            finally:
+                held[1] -= 1
+            return
+
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._held_locks[lock_path] = [fd, 1, exclusive]
+            try:
+                yield
+            finally:
+                del self._held_locks[lock_path]
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
     def load_json(self, filepath):
-        if os.path.exists(filepath):
-            with open(filepath, 'r') as f:
-                return json.load(f)
+        with self.file_lock(filepath), TRACE.span("load json", file=filepath):
+            if os.path.exists(filepath):
+                with open(filepath, 'r') as f:
+                    TRACE.count("config bytes read", os.fstat(f.fileno()).st_size)
+                    return json.load(f)
         return {}
 
     def save_json(self, filepath, data):
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=4)
+        # Write to a temp file in the same dir, fsync it and rename over the
+        # target so readers never see a truncated file
+        directory = os.path.dirname(filepath)
+        os.makedirs(directory, exist_ok=True)
+        with self.file_lock(filepath, True), TRACE.span("save json", file=filepath):
+            fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(filepath) + ".", suffix=".tmp", dir=directory)
+            try:
+                with contextlib.suppress(OSError): # mkstemp is 0600, keep the old file mode
+                    os.chmod(tmp_path, os.stat(filepath).st_mode if os.path.exists(filepath) else 0o644)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f, indent=4)
+                    TRACE.count("config bytes written", f.tell())
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, filepath)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+                raise
+            if hasattr(os, "O_DIRECTORY"): # persist the rename itself
+                dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
 
     def merge_dicts(self, d1, d2, first_priority=True):
         def merge_values(v1, v2):
@@ -133,21 +739,35 @@ class ConfigManager: # manage the config json files
 
         def merge_lists(l1, l2):
             merged = []
+            seen = set() # hashable items already merged
+            unhashable = [] # items that can only be compared with ==
+            dict_slots = {} # key set -> index of the first dict with those keys
+
+            def add(item):
+                try:
+                    if item in seen:
+                        return
+                    seen.add(item)
+                except TypeError:
+                    if item in unhashable:
+                        return
+                    unhashable.append(item)
+                if isinstance(item, dict):
+                    dict_slots.setdefault(frozenset(item), len(merged))
+                merged.append(item)
+
             for item in l1:
-                if item not in merged:
-                    merged.append(item)
+                add(item)
             for item in l2:
                 if isinstance(item, dict):
-                    found = False
-                    for idx, existing_item in enumerate(merged):
-                        if isinstance(existing_item, dict) and existing_item.keys() == item.keys():
-                            merged[idx] = self.merge_dicts(existing_item, item, first_priority)
-                            found = True
-                            break
-                    if not found:
+                    idx = dict_slots.get(frozenset(item))
+                    if idx is not None:
+                        merged[idx] = self.merge_dicts(merged[idx], item, first_priority)
+                    else:
+                        dict_slots[frozenset(item)] = len(merged)
                         merged.append(item)
-                elif item not in merged:
-                    merged.append(item)
+                else:
+                    add(item)
             return merged
 
         merged = {}
@@ -160,39 +780,119 @@ class ConfigManager: # manage the config json files
                 merged[key] = d2[key]
         return merged
 
+    def load_journal(self, data):
+        # Replay the journal records on top of the snapshot, a torn last
+        # line from an interrupted append is ignored. The first line names
+        # the snapshot generation the journal belongs to, a journal left
+        # over from before a compaction is skipped.
+        with self.file_lock(self.config_file):
+            if not os.path.exists(self.journal_file):
+                return data
+            with open(self.journal_file, 'r') as f, TRACE.span("replay journal"):
+                TRACE.count("config bytes read", os.fstat(f.fileno()).st_size)
+                header = True
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if header:
+                        header = False
+                        if isinstance(record, dict) and list(record) == ["journal_generation"]:
+                            if record["journal_generation"] != data.get("journal_generation",0):
+                                return data
+                            continue
+                    if isinstance(record, dict):
+                        with TRACE.span("merge dicts"):
+                            data = self.merge_dicts(data, record, False)
+        return data
+
+    def append_journal(self, data):
+        with self.file_lock(self.config_file, True):
+            os.makedirs(os.path.dirname(self.journal_file), exist_ok=True)
+            with open(self.journal_file, 'ab+') as f:
+                generation = self.load_json(self.config_file).get("journal_generation",0)
+                f.seek(0)
+                header = None
+                with contextlib.suppress(ValueError):
+                    header = json.loads(f.readline() or b"null")
+                if isinstance(header, dict) and list(header) == ["journal_generation"] and header["journal_generation"] != generation:
+                    # left behind by a compaction that died before removing it,
+                    # its records are in the snapshot and load_journal skips it
+                    f.truncate(0)
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                if size:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n": # terminate a torn record first
+                        f.write(b"\n")
+                else: # a new journal starts with the generation of the snapshot under it
+                    f.write(json.dumps({"journal_generation": generation}).encode() + b"\n")
+                line = json.dumps(data, separators=(",", ":")).encode() + b"\n"
+                f.write(line)
+                TRACE.count("config bytes written", len(line))
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            snapshot_size = os.path.getsize(self.config_file) if os.path.exists(self.config_file) else 0
+            if size > max(self.journal_compact_size, snapshot_size):
+                self.compact_journal()
+
+    def compact_journal(self, data=None):
+        # Fold the journal into a new snapshot of the next generation, then
+        # drop the journal. If we die in between, the old journal no longer
+        # matches the snapshot generation and is ignored.
+        with self.file_lock(self.config_file, True):
+            if data is None:
+                data = self.plugins_config
+            data = dict(data)
+            data["journal_generation"] = self.load_json(self.config_file).get("journal_generation",0) + 1
+            self.save_json(self.config_file, data)
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+
     @property # load
     def plugins_config(self):
-        return self.load_json(self.config_file)
+        with self.file_lock(self.config_file):
+            return self.load_journal(self.load_json(self.config_file))
 
     @plugins_config.setter #save
     def plugins_config(self, data, loaded_file_priority=False):
-        loaded_data = self.load_json(self.config_file)
+        if not loaded_file_priority:
+            # the common case, record the change instead of rewriting the file
+            self.append_journal(data)
+            return
+
+        with self.file_lock(self.config_file, True): # hold the write lock over read-merge-write
+            loaded_data = self.plugins_config
 
-        # if merge then loaded_data priority
-        # when setting defaut merge will be true
-        merged_data = self.merge_dicts(loaded_data, data, loaded_file_priority)
+            # if merge then loaded_data priority
+            # when setting defaut merge will be true
+            with TRACE.span("merge dicts"):
+                merged_data = self.merge_dicts(loaded_data, data, loaded_file_priority)
 
-        self.save_json(self.config_file, merged_data)
+            self.compact_journal(merged_data)
 
     @plugins_config.deleter #delete
     def plugins_config(self, deletion_path=None):
-        if deletion_path is None:
-            # If no path is given, clear the entire config
-            config = {}
-        else:
-            # Navigate through the dictionary to delete the specific path
-            config = self.plugins_config
-            current = config
-            try:
-                for key in deletion_path[:-1]:
-                    current = current[key]
+        with self.file_lock(self.config_file, True):
+            if deletion_path is None:
+                # If no path is given, clear the entire config
+                config = {}
+            else:
+                # Navigate through the dictionary to delete the specific path
+                config = self.plugins_config
+                current = config
+                try:
+                    for key in deletion_path[:-1]:
+                        current = current[key]
 
-                del current[deletion_path[-1]]
-            except Exception as e:
-                print(f"Failed to delete path {deletion_path}: {e}")
+                    del current[deletion_path[-1]]
+                except Exception as e:
+                    print(f"Failed to delete path {deletion_path}: {e}")
 
-        # Save the updated configuration
-        self.save_json(self.config_file, config)
+            # Save the updated configuration, deletions can not be journaled
+            self.compact_journal(config)
 
     @property
     def installed_plugins(self): # get list of plugins
@@ -223,11 +923,11 @@ class ConfigManager: # manage the config json files
         platforms_local = self.plugins_config.get("platforms_data",{})
         if div_time > self.platform_refresh_time:
             try:
-                with request.urlopen(self.platforms_file_url) as response:
-                    platforms_data = json.loads(response.read())
-                    self.platform_cache_time = unix_time
-                    self.platforms = platforms_data
-                    return platforms_data
+                data, _ = self.scheduler.fetch(self.platforms_file_url)
+                platforms_data = json.loads(data)
+                self.platform_cache_time = unix_time
+                self.platforms = platforms_data
+                return platforms_data
             except Exception as e:
                 return platforms_local
         else:
@@ -260,18 +960,103 @@ class ConfigManager: # manage the config json files
         self._plugin_soft_cache_time = unix_time
         self.plugins_config = {"plugin_soft_cache_time":unix_time}
 
+    def load_catalog(self, stamp):
+        if self._catalog and self._catalog.stamp == stamp:
+            TRACE.count("catalog cache hits")
+            return self._catalog
+        TRACE.count("catalog cache misses")
+        try:
+            with TRACE.span("open catalog"):
+                catalog = CatalogSnapshot(self.catalog_file(stamp), stamp)
+        except (OSError, ValueError) as e:
+            print(f"Catalog snapshot unusable, falling back to the config: {e}")
+            return None
+        if self._catalog:
+            self._catalog.close()
+        self._catalog = catalog
+        return catalog
+
+    def store_catalog(self, data):
+        # Write a new snapshot under a fresh stamp, then point the config at it.
+        # The old snapshot stays valid until the config is switched over.
+        with self.file_lock(self.config_file, True):
+            stamp = time.time_ns()
+            with TRACE.span("write catalog", plugins=len(data)):
+                CatalogSnapshot.write(self.catalog_file(stamp), data, stamp)
+            with TRACE.span("write search index", plugins=len(data)):
+                try:
+                    PluginSearchIndex(data).save(self.search_index_file(stamp))
+                except OSError as e: # -q builds the index itself then
+                    print(f"Could not save the search index: {e}")
+            config = self.plugins_config
+            if "online_cached_plugins" in config: # move the catalog out of the json config
+                del config["online_cached_plugins"]
+                config["online_cached_stamp"] = stamp
+                self.compact_journal(config)
+            else:
+                self.plugins_config = {"online_cached_stamp": stamp}
+            self.remove_catalogs(stamp)
+
+    def remove_catalogs(self, keep=None):
+        prefix = os.path.basename(self.catalog_file(""))
+        directory = os.path.dirname(self.config_file)
+        if not os.path.isdir(directory):
+            return
+        keep_names = {os.path.basename(self.catalog_file(keep)), os.path.basename(self.search_index_file(keep))}
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name not in keep_names:
+                with contextlib.suppress(OSError): # may still be mapped on windows
+                    os.remove(os.path.join(directory, name))
+
     @property
     def online_cached_plugins(self): # get list of plugins
-        return self.plugins_config.get("online_cached_plugins",{})
+        signature = self.config_signature()
+        if self._catalog is not None and signature == self._catalog_signature: # config untouched, skip parsing it
+            TRACE.count("catalog cache hits")
+            return self._catalog
+        with self.file_lock(self.config_file): # store_catalog can not swap the snapshot until it is open
+            config = self.plugins_config
+            stamp = config.get("online_cached_stamp")
+            if stamp:
+                catalog = self.load_catalog(stamp)
+                if catalog is not None:
+                    self._catalog_signature = signature
+                    return catalog
+        return config.get("online_cached_plugins",{})
 
     @online_cached_plugins.setter
     def online_cached_plugins(self, data): # save to list of plugins
-        self.plugins_config = {"online_cached_plugins":data}
+        with self.file_lock(self.config_file, True):
+            current = self.online_cached_plugins
+            if isinstance(current, CatalogSnapshot):
+                current = dict(current)
+            with TRACE.span("merge dicts"):
+                current = self.merge_dicts(current, data, False)
+            self.store_catalog(current)
 
     @online_cached_plugins.deleter
     def online_cached_plugins(self, deletion_path=[]):
-        deleter = self.__class__.plugins_config.fdel
-        deleter(self, ["online_cached_plugins"] + deletion_path)
+        with self.file_lock(self.config_file, True):
+            if deletion_path:
+                config = dict(self.online_cached_plugins)
+                current = config
+                try:
+                    for key in deletion_path[:-1]:
+                        current = current[key]
+
+                    del current[deletion_path[-1]]
+                except Exception as e:
+                    print(f"Failed to delete path {['online_cached_plugins'] + deletion_path}: {e}")
+                self.store_catalog(config)
+            else:
+                config = self.plugins_config
+                config.pop("online_cached_plugins", None)
+                config.pop("online_cached_stamp", None)
+                self.compact_journal(config)
+                if self._catalog:
+                    self._catalog.close()
+                    self._catalog = None
+                self.remove_catalogs()
 
 
 class OBSPluginPageParser(HTMLParser):
@@ -329,28 +1114,25 @@ class OBSPluginDownloader:
     def __init__(self,CFM):
         self.CFM = CFM
 
-    def remove_plugin(self,plugin_id,plugin_data):
-        pass
-
     def get_more_plugin_info(self,plugin_data):
         url = plugin_data.get("url")
         if not url:
-            print(f"The plugin with id {plugin_id} has no url, skipping")
+            print(f"The plugin {plugin_data.get('title')} has no url, skipping")
             return
 
-        with request.urlopen(url) as response: # get additonal plugin info
-            html_content = response.read().decode('utf-8')
-            parser = OBSPluginPageParser()
+        data, _ = self.CFM.scheduler.fetch(url) # get additonal plugin info
+        html_content = data.decode('utf-8')
+        parser = OBSPluginPageParser()
+        with TRACE.span("parse html", url=url):
             parser.feed(html_content)
 
         dl_url = url + "download"
         try:
-            with request.urlopen(dl_url): # get additonal download source
-                final_url = response.geturl()
-                if final_url and final_url not in dl_url and dl_url not in final_url:
-                    parser.plugin.update({"dl_link":final_url})
-                else:
-                    parser.plugin.update({"dl_link":None})
+            _, final_url = self.CFM.scheduler.fetch(dl_url, False) # get additonal download source
+            if final_url and final_url not in dl_url and dl_url not in final_url:
+                parser.plugin.update({"dl_link":final_url})
+            else:
+                parser.plugin.update({"dl_link":None})
         except Exception as e:
             parser.plugin.update({"dl_link":None})
 
@@ -375,15 +1157,16 @@ class OBSPluginDownloader:
         return re.compile(pattern)
 
     def installer_rules(self,plugin_data,platforms):
+        # Returns the first url the platform rules allow to download for this os
         urls = []
-        main_url = plugin_data["dl_link"]
+        main_url = plugin_data.get("dl_link")
         if main_url:
             urls.append(main_url)
-        bac_url = plugin_data["source"]
+        bac_url = plugin_data.get("source")
         if bac_url:
             urls.append(bac_url)
 
-        worked = False
+        pages = platforms.get("pages")
         for url in urls:
             https, base_url = (url+"//").split("//",1)
             if base_url == "":
@@ -393,38 +1176,324 @@ class OBSPluginDownloader:
                 base_url = base_url[:-2]
                 https = https + "//"
 
-        page, uri = (base_url + "/").split("/",1)
-        if len(uri) > 0:
-            uri = uri[:-1]
-
-        pages = platforms.get("pages")
-        if pages and page in pages.keys():
-            pattern_rules = {}
-            pattern_rules.update(platforms.get("url-match",{}))
-            pattern_rules.update(pages.get(page,{}))
-            for nr, rule in pattern_rules.items():
-                has = rule.get("has")
-                os = rule.get("os")
-                ret = rule.get("return")
-                over = rule.get("overwrite")
-                typ = rule.get("type")
-                follow = rule.get("follow")
-                if has:
-                    regex = self.wildcard_to_regex(has)
-                    if regex.match(uri) and isinstance(os,str) and platform.system().lower() in os.lower().replace("macos","darwin") and ret and ret == True:
-                        print("download and unzip if needed to plugin dir, HERE")
-                if over:
-                    print("overwrite url and find the correct file to download, then unzip if needed to plugin dir, HERE")
-
-
-    def install_plugin(self,plugin_id,plugin_data):
+            page, uri = (base_url + "/").split("/",1)
+            if len(uri) > 0:
+                uri = uri[:-1]
+
+            if pages and page in pages.keys():
+                pattern_rules = {}
+                pattern_rules.update(platforms.get("url-match",{}))
+                pattern_rules.update(pages.get(page,{}))
+                for nr, rule in pattern_rules.items():
+                    has = rule.get("has")
+                    rule_os = rule.get("os")
+                    ret = rule.get("return")
+                    over = rule.get("overwrite")
+                    typ = rule.get("type")
+                    follow = rule.get("follow")
+                    if has:
+                        regex = self.wildcard_to_regex(has)
+                        if regex.match(uri) and isinstance(rule_os,str) and platform.system().lower() in rule_os.lower().replace("macos","darwin") and ret and ret == True:
+                            return url
+                    if over:
+                        print(f"Url overwrite rules are not supported yet, skipping rule {nr} for {url}")
+        return None
+
+    def fetch_archive(self, url, version=None):
+        # Download and unpack once into the shared download cache, every
+        # install target links its files from there
+        key = hashlib.sha256(f"{url} {version}".encode()).hexdigest()[:16]
+        name = os.path.basename(parse.urlsplit(url).path) or "download"
+        archive = os.path.join(self.CFM.download_cache_path, f"{key}-{name}")
+        unpacked = archive + ".d"
+        if os.path.isdir(unpacked):
+            TRACE.count("download cache hits")
+            return unpacked
+
+        TRACE.count("download cache misses")
+        os.makedirs(self.CFM.download_cache_path, exist_ok=True)
+        if not os.path.exists(archive):
+            print(f"Downloading {url}")
+            data, _ = self.CFM.scheduler.fetch(url)
+            fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(archive) + ".", suffix=".tmp", dir=self.CFM.download_cache_path)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, archive)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+                raise
+
+        staging = tempfile.mkdtemp(prefix=os.path.basename(unpacked) + ".", dir=self.CFM.download_cache_path)
+        try:
+            if zipfile.is_zipfile(archive):
+                with zipfile.ZipFile(archive) as zf:
+                    zf.extractall(staging)
+            elif tarfile.is_tarfile(archive):
+                with tarfile.open(archive) as tf:
+                    if hasattr(tarfile, "data_filter"):
+                        tf.extractall(staging, filter="data")
+                    else:
+                        tf.extractall(staging)
+            else:
+                shutil.copy2(archive, os.path.join(staging, name))
+            entries = os.listdir(staging)
+            src = staging
+            if len(entries) == 1 and os.path.isdir(os.path.join(staging, entries[0])):
+                src = os.path.join(staging, entries[0]) # archive has a single top dir
+            try:
+                os.rename(src, unpacked)
+            except OSError:
+                if not os.path.isdir(unpacked): # else a parallel run unpacked it first
+                    raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return unpacked
+
+    def link_tree(self, src, dst):
+        # Hardlink every file, falling back to a copy across file systems
+        def link(src_file, dst_file):
+            try:
+                os.link(src_file, dst_file)
+            except OSError:
+                shutil.copy2(src_file, dst_file)
+        shutil.copytree(src, dst, copy_function=link, symlinks=True)
+
+    def plugin_dir_name(self, plugin_id, plugin_data):
+        url = plugin_data.get("url") or ""
+        slug = (["", ""] + url.split("/"))[-2]
+        return slug.rsplit(".", 1)[0] or f"plugin-{plugin_id}"
+
+    def install_plugin(self,plugin_id,plugin_data,targets):
+        # Resolve and download once, then place the files in every target
         installed = self.CFM.installed_plugins.get(plugin_id,{})
 
         plugin_data = self.get_more_plugin_info(plugin_data)
+        if not plugin_data:
+            return
 
         platforms_data = self.CFM.platforms
 
-        self.installer_rules(plugin_data, platforms_data)
+        url = self.installer_rules(plugin_data, platforms_data)
+        if not url:
+            print(f"No download for plugin id {plugin_id} matches this platform, skipping")
+            return
+        try:
+            unpacked = self.fetch_archive(url, plugin_data.get("updated"))
+        except Exception as e:
+            print(f"Failed to download plugin id {plugin_id} from {url}: {e}")
+            return
+
+        dir_name = self.plugin_dir_name(plugin_id, plugin_data)
+        installed_targets = dict(installed.get("targets",{}))
+        versions = self.target_versions(installed)
+        record = {key: value for key, value in installed.items() if key not in ("targets", "versions")}
+        swapped = False
+        for name, path in targets.items():
+            plugin_dir = os.path.join(path, dir_name)
+            target_record = record
+            if versions.get(name, record.get("updated")) != record.get("updated"): # target is behind the record
+                target_record = self.version_record(installed, versions[name])
+            try:
+                self.stage_and_swap(unpacked, plugin_dir, target_record)
+            except Exception as e:
+                print(f"Failed to install plugin id {plugin_id} to {plugin_dir}, the old version is kept: {e}")
+                continue
+            swapped = True
+            installed_targets[name] = plugin_dir
+            versions[name] = plugin_data.get("updated")
+            print(f"Installed plugin id {plugin_id} to {plugin_dir}")
+        if not swapped: # every target kept its old version, so does the record
+            return
+
+        plugin_data = dict(plugin_data)
+        plugin_data.update({"dl_file": url, "installed": int(time.time()), "targets": installed_targets, "versions": versions})
+        self.replace_record(plugin_id, plugin_data)
+
+    def target_versions(self, plugin_data): # updated stamp of the version in each target
+        versions = plugin_data.get("versions",{})
+        return {name: versions.get(name, plugin_data.get("updated")) for name in plugin_data.get("targets",{})}
+
+    def version_record(self, plugin_data, version):
+        # The record describes the newest installed version, older ones live on in the snapshots
+        for plugin_dir in plugin_data.get("targets",{}).values():
+            for stamp in reversed(self.list_snapshots(plugin_dir)):
+                with contextlib.suppress(OSError, ValueError):
+                    with open(os.path.join(self.snapshots_path(plugin_dir), f"{stamp}.json"), 'r') as f:
+                        snapshot_record = json.load(f)
+                    if snapshot_record.get("updated") == version:
+                        return snapshot_record
+        record = {key: value for key, value in plugin_data.items() if key not in ("targets", "versions")}
+        return dict(record, updated=version) # snapshot pruned, the newer record is the closest match
+
+    def refresh_record(self, plugin_id, plugin_data, targets, versions, known=()):
+        # Keep the record describing the newest version any target still runs,
+        # known are records of versions that just left the snapshots
+        record = {key: value for key, value in plugin_data.items() if key not in ("targets", "versions")}
+        newest = max(versions.values(), key=lambda version: version or 0)
+        if record.get("updated") != newest:
+            record = next((known_record for known_record in known if known_record.get("updated") == newest), None) \
+                     or self.version_record(plugin_data, newest)
+        self.replace_record(plugin_id, dict(record, targets=targets, versions=versions))
+
+    def replace_record(self, plugin_id, plugin_data):
+        # Setting installed_plugins merges into the old record, drop it first
+        # under the write lock so readers never see the plugin missing
+        with self.CFM.file_lock(self.CFM.config_file, True):
+            if plugin_id in self.CFM.installed_plugins:
+                deleter = self.CFM.__class__.installed_plugins.fdel
+                deleter(self.CFM, [plugin_id])
+            self.CFM.installed_plugins = {plugin_id: plugin_data}
+
+    def snapshots_path(self, plugin_dir): # per target, so snapshots can hardlink the installed files
+        return os.path.join(os.path.dirname(plugin_dir), ".obs-plugin-manager-snapshots", os.path.basename(plugin_dir))
+
+    def list_snapshots(self, plugin_dir): # oldest first
+        path = self.snapshots_path(plugin_dir)
+        if not os.path.isdir(path):
+            return []
+        return sorted((int(name) for name in os.listdir(path) if name.isdigit()))
+
+    def target_lock(self, plugin_dir): # one swap per plugin dir at a time, also across processes
+        parent, base = os.path.split(plugin_dir)
+        return self.CFM.file_lock(os.path.join(parent, f".{base}"), True)
+
+    @staticmethod
+    def pid_running(pid):
+        if pid == os.getpid() or os.name != "posix": # windows can not probe a pid without killing it
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def recover(self, plugin_dir):
+        # Undo a swap that was interrupted between its two renames. Call with
+        # the target lock held, leftovers of a still running manager are skipped.
+        parent, base = os.path.split(plugin_dir)
+        for name in sorted(os.listdir(parent)) if os.path.isdir(parent) else []:
+            match = re.match(rf"^\.{re.escape(base)}\.(old|staging)-(\d+)$", name)
+            if not match or self.pid_running(int(match.group(2))):
+                continue
+            path = os.path.join(parent, name)
+            if match.group(1) == "old" and not os.path.exists(plugin_dir):
+                os.rename(path, plugin_dir)
+            else:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def take_snapshot(self, plugin_dir, record):
+        stamp = time.time_ns()
+        path = self.snapshots_path(plugin_dir)
+        os.makedirs(path, exist_ok=True)
+        self.link_tree(plugin_dir, os.path.join(path, str(stamp)))
+        with open(os.path.join(path, f"{stamp}.json"), 'w') as f:
+            json.dump(record, f, indent=4)
+        self.prune_snapshots(plugin_dir)
+
+    def prune_snapshots(self, plugin_dir):
+        path = self.snapshots_path(plugin_dir)
+        stamps = self.list_snapshots(plugin_dir)
+        oldest = time.time_ns() - int(self.CFM.snapshot_max_age) * 10**9
+        keep = stamps[-int(self.CFM.snapshot_keep):] if int(self.CFM.snapshot_keep) > 0 else []
+        for stamp in stamps:
+            if stamp not in keep or stamp < oldest:
+                self.drop_snapshot(plugin_dir, stamp)
+
+    def drop_snapshot(self, plugin_dir, stamp):
+        path = os.path.join(self.snapshots_path(plugin_dir), str(stamp))
+        shutil.rmtree(path, ignore_errors=True)
+        with contextlib.suppress(OSError):
+            os.remove(path + ".json")
+
+    def stage_and_swap(self, src, plugin_dir, record=None):
+        # Hardlink src into a sibling staging dir, keep a snapshot of the
+        # current version, then swap the staging dir in with two renames
+        parent, base = os.path.split(plugin_dir)
+        os.makedirs(parent, exist_ok=True)
+        with self.target_lock(plugin_dir):
+            self.recover(plugin_dir)
+            staging = os.path.join(parent, f".{base}.staging-{os.getpid()}")
+            try:
+                self.link_tree(src, staging)
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+
+            old = None
+            try:
+                if os.path.exists(plugin_dir):
+                    if record is not None:
+                        self.take_snapshot(plugin_dir, record)
+                    old = os.path.join(parent, f".{base}.old-{os.getpid()}")
+                    os.rename(plugin_dir, old)
+                os.rename(staging, plugin_dir)
+            except BaseException:
+                if old and not os.path.exists(plugin_dir):
+                    os.rename(old, plugin_dir)
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+            if old:
+                shutil.rmtree(old, ignore_errors=True)
+
+    def rollback_plugin(self, plugin_id, plugin_data, targets=None):
+        installed_targets = plugin_data.get("targets",{})
+        if targets is None:
+            targets = installed_targets
+        versions = self.target_versions(plugin_data)
+        rolled_back = {}
+        for name in targets:
+            plugin_dir = installed_targets.get(name)
+            if not plugin_dir:
+                continue
+            with self.target_lock(plugin_dir): # a parallel install may prune the snapshots
+                stamps = self.list_snapshots(plugin_dir)
+                if not stamps:
+                    print(f"No snapshot to roll back plugin id {plugin_id} in {plugin_dir}")
+                    continue
+                snapshot = os.path.join(self.snapshots_path(plugin_dir), str(stamps[-1]))
+                try:
+                    self.stage_and_swap(snapshot, plugin_dir)
+                except Exception as e:
+                    print(f"Failed to roll back plugin id {plugin_id} in {plugin_dir}: {e}")
+                    continue
+                snapshot_record = {}
+                with contextlib.suppress(OSError, ValueError):
+                    with open(snapshot + ".json", 'r') as f:
+                        snapshot_record = json.load(f)
+                rolled_back[name] = snapshot_record
+                versions[name] = snapshot_record.get("updated")
+                self.drop_snapshot(plugin_dir, stamps[-1])
+                print(f"Rolled back plugin id {plugin_id} in {plugin_dir}")
+        if rolled_back:
+            self.refresh_record(plugin_id, plugin_data, installed_targets, versions, rolled_back.values())
+
+
+    def remove_plugin(self,plugin_id,plugin_data,targets=None):
+        installed_targets = plugin_data.get("targets",{})
+        if targets is None:
+            targets = installed_targets
+        for name in targets:
+            plugin_dir = installed_targets.get(name)
+            if not plugin_dir:
+                continue
+            if os.path.exists(plugin_dir):
+                with self.target_lock(plugin_dir):
+                    shutil.rmtree(plugin_dir)
+            print(f"Removed plugin id {plugin_id} from {plugin_dir}")
+            deleter = self.CFM.__class__.installed_plugins.fdel
+            deleter(self.CFM, [plugin_id, "targets", name])
+            if name in plugin_data.get("versions",{}):
+                deleter(self.CFM, [plugin_id, "versions", name])
+        remaining = self.CFM.installed_plugins.get(plugin_id,{})
+        if not remaining.get("targets"):
+            deleter = self.CFM.__class__.installed_plugins.fdel
+            deleter(self.CFM, [plugin_id])
+        elif remaining != plugin_data: # the newest version may have left with a target
+            self.refresh_record(plugin_id, plugin_data, remaining["targets"], self.target_versions(remaining))
 
 
 class OBSPluginsPageParser(HTMLParser):
@@ -546,12 +1615,184 @@ class OBSPluginsPageParser(HTMLParser):
         print(str(message))
 
 
+class PluginSearchIndex: # typo tolerant ranked search over the plugin catalog
+    # field boosts follow the priority map of exact_query_plugin_data, "name" is the url slug
+    BOOSTS = {"id": 6, "name": 4, "description": 3, "title": 2, "author": 1}
+    FIELDS = ("name", "description", "title", "author")
+    MIN_SIMILARITY = 0.5
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, plugins):
+        self.ids = []
+        self.id_index = {}
+        self.vocab = {} # token -> token id
+        self.tokens = []
+        self.grams = {} # trigram -> token ids containing it
+        self.postings = [] # token id -> [(doc, field, term frequency)]
+        self.lengths = {field: [] for field in self.FIELDS}
+
+        for doc, (plugin_id, plugin) in enumerate(plugins.items()):
+            self.ids.append(plugin_id)
+            self.id_index[str(plugin_id)] = doc
+            slug = (["", ""] + (plugin.get("url") or "").split("/"))[-2]
+            values = {
+                "name": slug.rsplit(".", 1)[0],
+                "description": plugin.get("description"),
+                "title": plugin.get("title"),
+                "author": plugin.get("author"),
+            }
+            for field in self.FIELDS:
+                words = self.tokenize(values[field])
+                self.lengths[field].append(len(words))
+                counts = {}
+                for word in words:
+                    counts[word] = counts.get(word, 0) + 1
+                for word, tf in counts.items():
+                    self.postings[self.token_id(word)].append((doc, field, tf))
+
+        self.docs = len(self.ids)
+        self.avg_lengths = {field: (sum(lengths) / self.docs if self.docs else 0) or 1 for field, lengths in self.lengths.items()}
+        self.idf = []
+        for postings in self.postings:
+            df = len({doc for doc, _, _ in postings})
+            self.idf.append(math.log(1 + (self.docs - df + 0.5) / (df + 0.5)))
+
+    def save(self, path):
+        # Stored next to the catalog snapshot so -q does not have to decode every record
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.__dict__, f, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            state = json.load(f)
+        index = cls.__new__(cls)
+        index.__dict__.update(state) # postings come back as lists, they only get unpacked
+        return index
+
+    @staticmethod
+    def tokenize(text):
+        if not isinstance(text, str):
+            return []
+        return re.findall(r"\w+", text.casefold())
+
+    @staticmethod
+    def trigrams(word):
+        padded = f"${word}$"
+        return {padded[i:i + 3] for i in range(max(1, len(padded) - 2))}
+
+    def token_id(self, word):
+        tid = self.vocab.get(word)
+        if tid is None:
+            tid = len(self.tokens)
+            self.vocab[word] = tid
+            self.tokens.append(word)
+            self.postings.append([])
+            for gram in self.trigrams(word):
+                self.grams.setdefault(gram, []).append(tid)
+        return tid
+
+    @staticmethod
+    def edit_distance(a, b, limit):
+        # Levenshtein distance with adjacent swaps, gives up above limit
+        previous2 = None
+        previous = list(range(len(b) + 1))
+        for i in range(1, len(a) + 1):
+            current = [i] + [0] * len(b)
+            for j in range(1, len(b) + 1):
+                current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+                if previous2 is not None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                    current[j] = min(current[j], previous2[j - 2] + 1)
+            if min(current) > limit:
+                return limit + 1
+            previous2, previous = previous, current
+        return previous[-1]
+
+    def expand(self, word):
+        # Vocabulary tokens close to word, with their trigram (dice) similarity
+        tid = self.vocab.get(word)
+        if tid is not None and len(word) < 3:
+            return {tid: 1.0} # too short to be fuzzy
+        grams = self.trigrams(word)
+        shared = {}
+        for gram in grams:
+            for tid in self.grams.get(gram, ()):
+                shared[tid] = shared.get(tid, 0) + 1
+        similar = {}
+        for tid, count in shared.items():
+            token = self.tokens[tid]
+            similarity = 2 * count / (len(grams) + len(self.trigrams(token)))
+            if token.startswith(word):
+                similarity = max(similarity, 0.9 if token != word else 1.0)
+            elif similarity < self.MIN_SIMILARITY and abs(len(token) - len(word)) <= 2:
+                # short words share few trigrams, fall back to the edit distance
+                distance = self.edit_distance(word, token, 2)
+                if distance <= 2:
+                    similarity = max(similarity, 1 - distance / max(len(word), len(token)))
+            if similarity >= self.MIN_SIMILARITY:
+                similar[tid] = similarity
+        return similar
+
+    def score_word(self, word, scores, allowed):
+        # BM25 per field, weighted by field boost and similarity of the matched token
+        best = {}
+        for tid, similarity in self.expand(word).items():
+            idf = self.idf[tid]
+            for doc, field, tf in self.postings[tid]:
+                if allowed is not None and doc not in allowed:
+                    continue
+                norm = 1 - self.B + self.B * self.lengths[field][doc] / self.avg_lengths[field]
+                score = similarity * self.BOOSTS[field] * idf * tf * (self.K1 + 1) / (tf + self.K1 * norm)
+                key = (doc, field)
+                if score > best.get(key, 0): # count the best matching token once per field
+                    best[key] = score
+        for (doc, field), score in best.items():
+            scores[doc] = scores.get(doc, 0) + score
+        doc = self.id_index.get(word)
+        if doc is not None and (allowed is None or doc in allowed):
+            scores[doc] = scores.get(doc, 0) + self.BOOSTS["id"] * 10 # an exact id beats any text match
+
+    def search(self, querys, plugin_ids=None, top=50):
+        # Every query needs to match, words within a query add up.
+        # Returns [(plugin id, score)] best first, at most top entries (0 for all).
+        allowed = None
+        if plugin_ids is not None:
+            allowed = {self.id_index[str(plugin_id)] for plugin_id in plugin_ids if str(plugin_id) in self.id_index}
+        total = None
+        for query in querys:
+            scores = {}
+            for word in self.tokenize(query):
+                self.score_word(word, scores, allowed)
+            if total is None:
+                total = scores
+            else:
+                total = {doc: score + scores[doc] for doc, score in total.items() if doc in scores}
+        if not total:
+            return []
+        if top:
+            best = heapq.nlargest(top, total.items(), key=lambda item: item[1])
+        else:
+            best = sorted(total.items(), key=lambda item: item[1], reverse=True)
+        return [(self.ids[doc], score) for doc, score in best]
+
+
 class OBSPluginManager:
-    def __init__(self, CFM):
+    def __init__(self, CFM, refresh=True):
         self.CFM = CFM
         self.plugin_active_page = 1
         self.plugin_last_page = 1
-        self.get_online_plugins()
+        self.search_index = None
+        self.search_source = None # catalog the search index was built from
+        if refresh:
+            self.get_online_plugins()
 
 
     def get_online_plugins(self):
@@ -560,39 +1801,54 @@ class OBSPluginManager:
         div_soft_time = unix_time - int(self.CFM.plugin_soft_cache_time)
 
         if div_soft_time > self.CFM.plugin_soft_refresh_time or div_time > self.CFM.plugin_refresh_time:
-            if div_time > self.CFM.plugin_refresh_time:
-                del self.CFM.online_cached_plugins
-                self.CFM.online_cached_plugins = self.scrape_obs_plugins_all()
-                self.CFM.plugin_cache_time = unix_time
-            else:
-                self.CFM.online_cached_plugins = self.scrape_obs_plugins()
+            TRACE.count("plugin index cache misses")
+            # a failed scrape keeps the old catalog, it is only replaced by a complete one
+            try:
+                if self.CFM.catalog_mirror_url: # another machine scrapes, only sync what changed
+                    CatalogMirror(self.CFM).sync()
+                    return
+                if div_time > self.CFM.plugin_refresh_time:
+                    self.CFM.store_catalog(self.scrape_obs_plugins_all())
+                    self.CFM.plugin_cache_time = unix_time
+                else:
+                    self.CFM.online_cached_plugins = self.scrape_obs_plugins()
+            except Exception as e:
+                print(f"Plugin index refresh failed, keeping the cached plugins: {e}")
+                return
             self.CFM.plugin_soft_cache_time = unix_time
+        else:
+            TRACE.count("plugin index cache hits")
 
     def scrape_obs_plugins_all(self):
-        plugins = {}
-        while self.plugin_active_page <= self.plugin_last_page:
-            plugins.update(self.scrape_obs_plugins())
-            self.plugin_active_page += 1
+        plugins = self.scrape_obs_plugins() # the first page tells us the page count
+        pages = range(self.plugin_active_page + 1, self.plugin_last_page + 1)
+        for page_plugins in self.CFM.scheduler.map(self.scrape_obs_plugins, pages):
+            plugins.update(page_plugins)
+        self.plugin_active_page = self.plugin_last_page
         return plugins
 
-    def scrape_obs_plugins(self):
-        url = f"{self.CFM.plugin_forum_url}{self.CFM.plugin_forum_page_request}{self.plugin_active_page}"
+    def scrape_obs_plugins(self, page=None):
+        if page is None:
+            page = self.plugin_active_page
+        url = f"{self.CFM.plugin_forum_url}{self.CFM.plugin_forum_page_request}{page}"
         try:
-            with request.urlopen(url) as response:
-                print("Getting Plugin Page: " + str(self.plugin_active_page))
-                html_content = response.read().decode('utf-8')
-                parser = OBSPluginsPageParser(CFM.plugin_forum_url)
-                parser.feed(html_content)
-                self.plugin_last_page = parser.last_page # update last page
-                return parser.plugins
+            data, _ = self.CFM.scheduler.fetch(url)
         except Exception as e:
-            print(f"Error fetching {url}: {e}")
-            return {}
+            raise RuntimeError(f"Error fetching {url}: {e}") from e
+        print("Getting Plugin Page: " + str(page))
+        html_content = data.decode('utf-8')
+        parser = OBSPluginsPageParser(self.CFM.plugin_forum_url)
+        with TRACE.span("parse html", url=url):
+            parser.feed(html_content)
+        self.plugin_last_page = max(self.plugin_last_page, parser.last_page) # update last page
+        return parser.plugins
 
-    def plugin_actions_from_data(self, plugins=None, remove=False):
+    def plugin_actions_from_data(self, plugins=None, remove=False, targets=None):
+        # targets maps target names to plugin dirs, None keeps the targets a plugin is installed to
         installed_plugins = self.CFM.installed_plugins
+        updating = plugins is None
         if plugins is None:
-            plugin = installed_plugins
+            plugins = installed_plugins
         online_plugins = self.CFM.online_cached_plugins
 
         OPD = OBSPluginDownloader(self.CFM)
@@ -608,32 +1864,35 @@ class OBSPluginManager:
                     plugin.update(installed_data)
                     installed_data = plugin
             if remove and installed_data:
-                #print(f"Remove plugin with id {plugin_id} {installed_data} here")
-                OPD.remove_plugin(plugin_id,installed_data)
+                OPD.remove_plugin(plugin_id,installed_data,targets)
             elif online_data:
-                #print(f"Install / Update plugin with id {plugin_id} {online_data} here")
-                OPD.install_plugin(plugin_id,online_data)
+                plugin_targets = targets
+                if updating or plugin_targets is None: # only update where it is installed
+                    versions = OPD.target_versions(installed_data)
+                    plugin_targets = {name: os.path.dirname(plugin_dir) for name, plugin_dir in installed_data.get("targets",{}).items()
+                                      if (targets is None or name in targets)
+                                      and not (updating and versions.get(name) == online_data.get("updated"))} # nothing new online for this target
+                if plugin_targets:
+                    OPD.install_plugin(plugin_id,dict(online_data),plugin_targets)
 
 
-    def query_plugin_data(self, data, query):
-        found_plugins = {}
-        online_plugins = data
-        for plugin_id, plugin_infos in online_plugins.items():
-            for info_key, plugin_info in plugin_infos.items():
-                if info_key == "url":
-                    plugin_info = plugin_info.split("/")[-2]
-                if isinstance(plugin_info, str) and query.lower() in plugin_info.lower():
-                    found_plugins.update({plugin_id:plugin_infos})
-                    break
-
-        return found_plugins
-
     def exact_query_plugin_data(self, data, query):
         found_plugins = {}
         online_plugins = data
         special = None
         priority = {"id":6,"url":5,"name":4,"description":3,"title":2,"author":1}
         current_priority = 0
+        if isinstance(online_plugins, CatalogSnapshot): # use the snapshot lookup, only decode the hits
+            for plugin_id, info_key in online_plugins.lookup(query.lower()):
+                new_priority = priority.get(info_key,0)
+                if new_priority >= current_priority:
+                    if new_priority > current_priority:
+                        found_plugins = {}
+                        current_priority = int(new_priority)
+                    found_plugins[plugin_id] = None
+            found_plugins = {plugin_id: online_plugins[plugin_id] for plugin_id in online_plugins if plugin_id in found_plugins}
+            return found_plugins, current_priority
+
         for plugin_id, plugin_infos in online_plugins.items():
             for info_key, plugin_info in plugin_infos.items():
                 if info_key == "url":
@@ -678,6 +1937,14 @@ class OBSPluginManager:
                 pass
             else:
                 found = {}
+                column = data.column(key) if isinstance(data, CatalogSnapshot) else None
+                if column is not None and operator in NUMBER_OPERATORS: # filter the numeric column, decode only the hits
+                    compare = NUMBER_OPERATORS[operator]
+                    for idx, plugin_id in enumerate(data):
+                        if column[idx] is not None and compare(column[idx], number):
+                            found[plugin_id] = data.record(idx)
+                    data = found
+                    continue
                 for plugin_id, plugin_infos in data.items():
                     for info_key, plugin_info in plugin_infos.items():
                         if info_key == key and isinstance(plugin_info, tuple([int, float])):
@@ -704,12 +1971,6 @@ class OBSPluginManager:
         return data
 
 
-    def limit_plugin_querys(self,data,querys):
-        for query in querys:
-            data = self.query_plugin_data(data, query)
-
-        return data
-
     def parse_number_conditions(self,condition_strings):
         conditions = []
         i = 0
@@ -770,21 +2031,23 @@ class OBSPluginManager:
 
 
     def plugins_print(self, data, top_nl=True):
-        if top_nl:
-            print("")
-        for plugin_id, plugin_infos in data.items():
-            print(f"--- Plugin id {plugin_id} ---")
-            for info_key, plugin_info in plugin_infos.items():
-                print(f"{info_key}: {plugin_info}")
-                if info_key == "url" and isinstance(plugin_info, str):
-                    print(f"{info_key}_title: {(["",""] + plugin_info.split("/"))[-2].split(".")[0]}")
-            print("")
+        with TRACE.span("print", plugins=len(data)):
+            if top_nl:
+                print("")
+            for plugin_id, plugin_infos in data.items():
+                print(f"--- Plugin id {plugin_id} ---")
+                for info_key, plugin_info in plugin_infos.items():
+                    print(f"{info_key}: {plugin_info}")
+                    if info_key == "url" and isinstance(plugin_info, str):
+                        print(f"{info_key}_title: {(["",""] + plugin_info.split("/"))[-2].split(".")[0]}")
+                print("")
 
     def match_plugin_querys(self, data, querys):
         match_data = {}
         for query in querys:
             target_plugin = {}
-            results, _ = self.exact_query_plugin_data(data, query)
+            with TRACE.span("match", query=query):
+                results, _ = self.exact_query_plugin_data(data, query)
             sorted_results = self.sort_dict_by_key(results,None)
             nr_results = len(sorted_results)
             if nr_results == 0:
@@ -802,32 +2065,390 @@ class OBSPluginManager:
         return match_data
 
 
-    def download_plugins(self, querys):
+    def download_plugins(self, querys, targets):
         online_plugins = self.CFM.online_cached_plugins
         to_install = self.match_plugin_querys(online_plugins, querys)
-        self.plugin_actions_from_data(to_install)
+        self.plugin_actions_from_data(to_install, False, targets)
 
-    def remove_plugins(self, querys):
+    def remove_plugins(self, querys, targets=None):
         installed_plugins = self.CFM.installed_plugins
         to_remove = self.match_plugin_querys(installed_plugins, querys)
-        self.plugin_actions_from_data(to_remove,True)
-
-    def query_plugins(self, querys, number_query, sort):
-        online_plugins = self.CFM.online_cached_plugins
+        self.plugin_actions_from_data(to_remove, True, targets)
+
+    def get_search_index(self, catalog):
+        if self.search_source is not catalog:
+            self.search_index = None
+            if isinstance(catalog, CatalogSnapshot):
+                with TRACE.span("load search index"), contextlib.suppress(OSError, ValueError):
+                    self.search_index = PluginSearchIndex.load(self.CFM.search_index_file(catalog.stamp))
+            if self.search_index is None:
+                with TRACE.span("build search index", plugins=len(catalog)):
+                    self.search_index = PluginSearchIndex(catalog)
+            self.search_source = catalog
+        return self.search_index
+
+    def query_plugins(self, querys, number_query, sort, top=50):
+        catalog = online_plugins = self.CFM.online_cached_plugins
         if number_query:
-            number_conditions = self.parse_number_conditions(number_query)
-            online_plugins = self.limit_number_query(online_plugins, number_conditions)
+            with TRACE.span("number filter"):
+                number_conditions = self.parse_number_conditions(number_query)
+                online_plugins = self.limit_number_query(online_plugins, number_conditions)
         if querys:
-            online_plugins = self.limit_plugin_querys(online_plugins, querys)
-        sorted_plugins = self.sort_dict_by_key(online_plugins, sort)
+            with TRACE.span("query"):
+                index = self.get_search_index(catalog)
+                ranked = index.search(querys, online_plugins if number_query else None, top)
+                online_plugins = {plugin_id: catalog[plugin_id] for plugin_id, _ in ranked}
+            if sort is None: # keep the ranking, best match first
+                return {plugin_id: dict(sorted(plugin.items())) for plugin_id, plugin in online_plugins.items()}
+        with TRACE.span("sort"):
+            sorted_plugins = self.sort_dict_by_key(online_plugins, sort)
         return sorted_plugins
 
 
-    def update_installed_plugins(self):
-        self.plugin_actions_from_data()
+    def rollback_plugins(self, querys, targets=None):
+        installed_plugins = self.CFM.installed_plugins
+        to_rollback = self.match_plugin_querys(installed_plugins, querys)
+        OPD = OBSPluginDownloader(self.CFM)
+        for plugin_id, plugin_data in to_rollback.items():
+            OPD.rollback_plugin(plugin_id, plugin_data, targets)
+
+    def update_installed_plugins(self, targets=None):
+        self.plugin_actions_from_data(None, False, targets)
+
+
+class CatalogMirror: # export, serve and delta sync a scraped catalog for a fleet of machines
+    FORMAT = 1
+    MANIFEST = "manifest.json"
+
+    def __init__(self, CFM):
+        self.CFM = CFM
+
+    def read_file(self, source, name):
+        if re.match(r"^https?://", source):
+            data, _ = self.CFM.scheduler.fetch(source.rstrip("/") + "/" + name)
+        else:
+            with open(os.path.join(source, name), 'rb') as f:
+                data = f.read()
+        if name.endswith(".gz"):
+            data = gzip.decompress(data)
+        return json.loads(data)
+
+    def write_file(self, directory, name, data):
+        blob = json.dumps(data, separators=(",", ":")).encode()
+        if name.endswith(".gz"):
+            blob = gzip.compress(blob)
+        fd, tmp_path = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blob)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, os.path.join(directory, name))
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+
+    def add_details(self, plugins, previous):
+        # Plugin page details only change with the plugin, reuse the last export where possible
+        OPD = OBSPluginDownloader(self.CFM)
+        missing = []
+        for plugin_id, plugin in plugins.items():
+            old = previous.get(plugin_id, {})
+            if "source" in old and old.get("updated") == plugin.get("updated"):
+                plugin.update({key: value for key, value in old.items() if key not in plugin})
+            else:
+                missing.append(plugin_id)
+
+        def fetch_details(plugin_id):
+            try:
+                OPD.get_more_plugin_info(plugins[plugin_id])
+            except Exception as e:
+                print(f"Could not get details for plugin {plugin_id}: {e}")
+
+        print(f"Getting details for {len(missing)} plugins")
+        self.CFM.scheduler.map(fetch_details, missing)
+
+    def export(self, directory, details=False, keep_deltas=30):
+        os.makedirs(directory, exist_ok=True)
+        try:
+            manifest = self.read_file(directory, self.MANIFEST)
+            previous = self.read_file(directory, manifest["full"])
+        except (OSError, ValueError, KeyError):
+            manifest = {"format": self.FORMAT, "id": f"{time.time_ns():x}", "version": 0, "full": None, "deltas": []}
+            previous = {"plugins": {}, "platforms_data": {}}
+
+        plugins = dict(self.CFM.online_cached_plugins)
+        if not plugins:
+            print("No cached plugins to export, refresh the plugin index first")
+            return False
+        if details:
+            self.add_details(plugins, previous["plugins"])
+        platforms_data = self.CFM.plugins_config.get("platforms_data", {})
+
+        old_plugins = previous["plugins"]
+        changed = {plugin_id: plugin for plugin_id, plugin in plugins.items() if old_plugins.get(plugin_id) != plugin}
+        removed = [plugin_id for plugin_id in old_plugins if plugin_id not in plugins]
+        if manifest["full"] and not changed and not removed and platforms_data == previous["platforms_data"]:
+            print(f"Mirror in {directory} is already up to date at version {manifest['version']}")
+            return True
+
+        version = manifest["version"] + 1
+        full_name = f"catalog-{version}.json.gz"
+        self.write_file(directory, full_name, {"format": self.FORMAT, "id": manifest["id"], "version": version,
+                                               "plugins": plugins, "platforms_data": platforms_data})
+        deltas = list(manifest["deltas"])
+        if manifest["full"]:
+            delta_name = f"delta-{version}.json.gz"
+            delta = {"from": version - 1, "to": version, "changed": changed, "removed": removed}
+            if platforms_data != previous["platforms_data"]:
+                delta["platforms_data"] = platforms_data
+            self.write_file(directory, delta_name, delta)
+            deltas.append({"from": version - 1, "to": version, "file": delta_name})
+        pruned = deltas[:max(0, len(deltas) - keep_deltas)]
+        deltas = deltas[len(pruned):]
+
+        old_full = manifest["full"]
+        manifest.update({"version": version, "full": full_name, "deltas": deltas, "plugin_cache_time": int(time.time())})
+        self.write_file(directory, self.MANIFEST, manifest) # clients only see the new files once this is in place
+        for name in [old_full] + [entry["file"] for entry in pruned]:
+            if name:
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(directory, name))
+        print(f"Exported {len(plugins)} plugins to {directory} as version {version} ({len(changed)} changed, {len(removed)} removed)")
+        return True
+
+    def sync(self, source=None):
+        source = source or self.CFM.catalog_mirror_url
+        if not source:
+            raise ValueError("no catalog mirror set")
+        manifest = self.read_file(source, self.MANIFEST)
+        if manifest.get("format") != self.FORMAT:
+            raise ValueError(f"unsupported mirror format {manifest.get('format')}")
+        local = self.CFM.catalog_mirror_version
+        version = manifest["version"]
+        if local.get("id") == manifest["id"] and local.get("version") == version:
+            unix_time = int(time.time()) # checked, so no need to ask the mirror again until the next refresh
+            self.CFM.plugin_cache_time = unix_time
+            self.CFM.plugin_soft_cache_time = unix_time
+            return False
+
+        chain = []
+        if local.get("id") == manifest["id"]:
+            current = local.get("version")
+            for entry in manifest["deltas"]:
+                if entry["from"] == current:
+                    chain.append(entry)
+                    current = entry["to"]
+            if current != version:
+                chain = None # too old for the kept deltas
+        else:
+            chain = None
+
+        plugins = dict(self.CFM.online_cached_plugins) if chain else None
+        if chain and plugins:
+            platforms_data = None
+            for entry in chain:
+                delta = self.read_file(source, entry["file"])
+                plugins.update(delta["changed"])
+                for plugin_id in delta["removed"]:
+                    plugins.pop(plugin_id, None)
+                if "platforms_data" in delta:
+                    platforms_data = delta["platforms_data"]
+            print(f"Applied {len(chain)} mirror deltas up to version {version}")
+        else:
+            full = self.read_file(source, manifest["full"])
+            plugins = full["plugins"]
+            platforms_data = full["platforms_data"]
+            print(f"Downloaded full mirror catalog version {version} ({len(plugins)} plugins)")
+
+        unix_time = int(time.time())
+        self.CFM.store_catalog(plugins)
+        if platforms_data:
+            if "platforms_data" in self.CFM.plugins_config:
+                del self.CFM.platforms
+            self.CFM.platforms = platforms_data
+            self.CFM.platform_cache_time = unix_time
+        self.CFM.catalog_mirror_version = {"id": manifest["id"], "version": version}
+        self.CFM.plugin_cache_time = unix_time
+        self.CFM.plugin_soft_cache_time = unix_time
+        return True
+
+    def serve(self, directory, port=8765):
+        handler = functools.partial(SimpleHTTPRequestHandler, directory=directory)
+        with ThreadingHTTPServer(("", port), handler) as server:
+            print(f"Serving catalog mirror {directory} on port {port}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+
+class PluginDaemon: # keeps the catalog and search index hot and answers requests over a unix socket
+    # Protocol: one json object per line each way, eg
+    #   {"cmd": "query", "query": ["move"], "number_filter": [], "sort": null, "top": 50}
+    #   -> {"ok": true, "output": "<printed text>", "plugins": {...}}
+    # cmds: ping, status, query, match, install, remove, update, rollback, refresh
+    MIN_REFRESH_WAIT = 60
+    MAX_REFRESH_WAIT = 3600
+
+    def __init__(self, CFM):
+        self.CFM = CFM
+        self.OPM = None
+        self.lock = threading.Lock() # requests and refreshes run one at a time
+        self.stop = threading.Event()
+        self.started = time.time()
+
+    @staticmethod
+    def connect(socket_path):
+        if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+            return None
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(socket_path)
+        except OSError:
+            conn.close()
+            return None
+        return conn
+
+    @staticmethod
+    def send(conn, request):
+        conn.sendall(json.dumps(request).encode() + b"\n")
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = conn.recv(65536)
+            if not chunk:
+                raise ConnectionError("daemon closed the connection")
+            data += chunk
+        return json.loads(data)
+
+    @staticmethod
+    def string_list(request, key, default=None):
+        value = request.get(key)
+        if value is None:
+            return default
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            raise ValueError(f"{key} needs to be a list of strings")
+        return value
+
+    def handle(self, request):
+        with self.lock:
+            out = io.StringIO()
+            result = {}
+            try:
+                cmd = request.get("cmd")
+                querys = self.string_list(request, "query", [])
+                number_filter = self.string_list(request, "number_filter", [])
+                targets = self.string_list(request, "target")
+                with contextlib.redirect_stdout(out):
+                    if cmd == "ping":
+                        pass
+                    elif cmd == "status":
+                        self.CFM.reload()
+                        result = {"pid": os.getpid(), "uptime": time.time() - self.started,
+                                  "plugins": len(self.CFM.online_cached_plugins),
+                                  "plugin_cache_time": self.CFM.plugin_cache_time,
+                                  "plugin_soft_cache_time": self.CFM.plugin_soft_cache_time,
+                                  "installed": self.CFM.installed_plugins}
+                    elif cmd == "query":
+                        result = {"plugins": self.OPM.query_plugins(querys, number_filter,
+                                                                    request.get("sort"), request.get("top", 50))}
+                    elif cmd == "match":
+                        result = {"plugins": self.OPM.match_plugin_querys(self.CFM.online_cached_plugins, querys)}
+                    elif cmd == "install":
+                        self.OPM.download_plugins(querys, self.CFM.install_paths(targets))
+                    elif cmd == "remove":
+                        self.OPM.remove_plugins(querys, self.CFM.install_paths(targets) if targets else None)
+                    elif cmd == "update":
+                        self.OPM.update_installed_plugins(self.CFM.install_paths(targets) if targets else None)
+                    elif cmd == "rollback":
+                        self.OPM.rollback_plugins(querys, self.CFM.install_paths(targets) if targets else None)
+                    elif cmd == "refresh":
+                        self.CFM.reload()
+                        self.OPM.get_online_plugins()
+                    else:
+                        raise ValueError(f"unknown cmd {cmd}")
+            except Exception as e:
+                return {"ok": False, "error": str(e), "output": out.getvalue()}
+            return {"ok": True, "output": out.getvalue(), **result}
+
+    def refresh_loop(self):
+        # Refresh the index when it is due, like a cli run would
+        while True:
+            with self.lock:
+                self.CFM.reload()
+                self.OPM.get_online_plugins()
+                now = int(time.time())
+                due = min(int(self.CFM.plugin_soft_cache_time) + self.CFM.plugin_soft_refresh_time,
+                          int(self.CFM.plugin_cache_time) + self.CFM.plugin_refresh_time)
+            if self.stop.wait(min(self.MAX_REFRESH_WAIT, max(self.MIN_REFRESH_WAIT, due - now))):
+                return
+
+    def serve(self):
+        if not hasattr(socket, "AF_UNIX"):
+            print("The daemon needs unix sockets, which this platform does not have")
+            return
+        socket_path = self.CFM.daemon_socket
+        conn = self.connect(socket_path)
+        if conn:
+            conn.close()
+            print(f"A daemon is already running on {socket_path}")
+            return
+        with contextlib.suppress(FileNotFoundError): # stale socket of a daemon that was killed
+            os.remove(socket_path)
+
+        self.OPM = OBSPluginManager(self.CFM)
+        catalog = self.CFM.online_cached_plugins
+        self.OPM.get_search_index(catalog) # warm up
+        print(f"Loaded {len(catalog)} plugins")
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile: # a client may keep the connection for many requests
+                    try:
+                        request = json.loads(line)
+                    except ValueError as e:
+                        response = {"ok": False, "error": f"invalid request: {e}"}
+                    else:
+                        if isinstance(request, dict):
+                            response = daemon.handle(request)
+                        else:
+                            response = {"ok": False, "error": "invalid request: expected a json object"}
+                    self.wfile.write(json.dumps(response).encode() + b"\n")
+                    self.wfile.flush()
+
+        class Server(socketserver.ThreadingUnixStreamServer):
+            daemon_threads = True # an idle client connection must not keep the daemon alive
+
+        with Server(socket_path, Handler) as server:
+            os.chmod(socket_path, 0o600)
+            refresher = threading.Thread(target=self.refresh_loop, daemon=True)
+            refresher.start()
+            print(f"Serving on {socket_path}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.stop.set()
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(socket_path)
 
 
 if __name__ == "__main__": # Run the steps
+    # instrumentation flags are read first so the startup config load is measured too
+    trace_parser = argparse.ArgumentParser(add_help=False)
+    trace_parser.add_argument('--timings', action='store_true', help='print a per phase timing and io summary when done')
+    trace_parser.add_argument('--trace', default=None, metavar='FILE', help='write a json trace of the run, loadable in a trace viewer')
+    trace_args, _ = trace_parser.parse_known_args()
+    if trace_args.timings or trace_args.trace:
+        TRACE.enable()
+        if trace_args.timings:
+            atexit.register(TRACE.print_summary)
+        if trace_args.trace:
+            atexit.register(TRACE.write_trace, trace_args.trace)
+
     OSM = OSManager()
     CFM = ConfigManager(OSM.config_path, OSM.plugins_path)
 
@@ -835,28 +2456,44 @@ if __name__ == "__main__": # Run the steps
         prog='obs-plugin-manager.py',
         description='A OBS plugin manager, finder and downloader',
         add_help=False,
+        parents=[trace_parser],
         epilog='')
     parser.add_argument('-h', '--help', action='store_true', help='show this help message and exit')
-    parser.add_argument('-q', '--query', nargs="+", action='extend', default=[], help='search for an online database plugin')
+    parser.add_argument('-q', '--query', nargs="+", action='extend', default=[], help='search for an online database plugin, typo tolerant and ranked by relevance')
     parser.add_argument('-n', '--number-filter', dest='number_filter', nargs="+", action='extend', default=[], help='search for number conditons eg: -n "stars>4" "downloads>1000"')
     parser.add_argument('-i', '--install', nargs="+", action='extend', default=[], help='install a online database plugin/s')
     parser.add_argument('-r', '--remove', nargs="+", action='extend', default=[], help='remove installed plugin/s')
     parser.add_argument('-u', '--update', action='store_true', help='update installed plugins')
+    parser.add_argument('--rollback', nargs="+", action='extend', default=[], help='restore the previous version of installed plugin/s')
+    parser.add_argument('-t', '--target', nargs="+", action='extend', default=None, help='install target/s to use for -i, -u, -r and --rollback, "all" for every target (default: "default")')
+    parser.add_argument('--add-target', dest='add_target', nargs=2, metavar=('NAME', 'PATH'), action='append', default=[], help='add a named install target, eg a portable obs plugin dir')
+    parser.add_argument('--remove-target', dest='remove_target', nargs="+", action='extend', default=[], metavar='NAME', help='remove named install target/s, installed files are kept')
+    parser.add_argument('-k', '--top', type=int, default=50, help='show only the best k query matches, 0 for all (default: 50)')
     parser.add_argument('-s', '--sort', choices={"id","author","title","updated","uploaded","url","stars"}, help='sort the querry output by key')
     #parser.add_argument('-o', '--ols', action='store_true', help='list indexed online plugins')
     #parser.add_argument('-l', '--ls', action='store_true', help='list installed plugins')
     #parser.add_argument('-d', '--dignore', action='store_true', help='disable ignore list')
     #parser.add_argument('-g', '--ignoreurl', default='', help='set ignore url')
     parser.add_argument('-p', '--platform-url', dest='platform_url', default=None, help=f'set platform json url (currently: "{CFM.platforms_file_url}")')
+    parser.add_argument('--serve', action='store_true', help='run a daemon that keeps the plugin index loaded, later runs use it for -q, -i, -r, -u and --rollback')
+    parser.add_argument('--no-daemon', dest='no_daemon', action='store_true', help='do not use a running daemon')
     parser.add_argument('-c', '--config', default=None, help=f'Config file to use (currently: "{CFM.config_file}")')
+    parser.add_argument('-m', '--mirror-url', dest='mirror_url', default=None, help=f'sync the plugin index from a catalog mirror path or url instead of the forum, "" to disable (currently: "{CFM.catalog_mirror_url}")')
+    parser.add_argument('--mirror-import', dest='mirror_import', nargs='?', const='', default=None, metavar='SOURCE', help='sync the plugin index from a catalog mirror now (default: the set mirror url)')
+    parser.add_argument('--mirror-export', dest='mirror_export', default=None, metavar='DIR', help='export the plugin index as a new catalog mirror version into DIR')
+    parser.add_argument('--mirror-details', dest='mirror_details', action='store_true', help='include plugin page details in the mirror export')
+    parser.add_argument('--mirror-serve', dest='mirror_serve', default=None, metavar='DIR', help='serve a catalog mirror directory over http')
+    parser.add_argument('--mirror-port', dest='mirror_port', type=int, default=8765, help='port for --mirror-serve (default: 8765)')
 
     args = parser.parse_args()
 
     if args.config:
-        CFM.config_file = arg.config
+        CFM.config_file = args.config
 
-    plugin_args = any([args.query, args.install, args.remove, args.update, args.number_filter])
-    action_args = plugin_args or any([args.platform_url])
+    plugin_args = any([args.query, args.install, args.remove, args.update, args.number_filter, args.rollback])
+    mirror_args = any([args.mirror_import is not None, args.mirror_export, args.mirror_serve])
+    target_args = any([args.add_target, args.remove_target])
+    action_args = plugin_args or mirror_args or target_args or any([args.platform_url, args.mirror_url is not None, args.serve])
 
     if not action_args or args.help: # if no args are set or help is used
         parser.print_help() # print help
@@ -866,23 +2503,83 @@ if __name__ == "__main__": # Run the steps
     if args.platform_url:
         CFM.platforms_file_url = args.platform_url
 
-    if plugin_args: # if these args are set the plugin manager needs to run
+    if args.mirror_url is not None:
+        CFM.catalog_mirror_url = args.mirror_url
+
+    for name, path in args.add_target:
+        if name in ("default", "all"):
+            print(f"The target name {name} is reserved, pick another one")
+            continue
+        CFM.install_targets = {name: os.path.abspath(os.path.expanduser(path))}
+
+    for name in args.remove_target:
+        if name in CFM.install_targets:
+            deleter = CFM.__class__.install_targets.fdel
+            deleter(CFM, [name])
+        else:
+            print(f"Unknown install target {name}")
+
+    if args.mirror_import is not None:
+        try:
+            if not CatalogMirror(CFM).sync(args.mirror_import):
+                print(f"Plugin index is up to date with the mirror (version {CFM.catalog_mirror_version.get('version')})")
+        except Exception as e:
+            print(f"Mirror import failed: {e}")
 
-        OPM = OBSPluginManager(CFM) # update online index if needed
+    if args.mirror_export:
+        OBSPluginManager(CFM) # update online index if needed
+        CatalogMirror(CFM).export(args.mirror_export, args.mirror_details)
 
+    daemon = None
+    if plugin_args and not args.no_daemon:
+        daemon = PluginDaemon.connect(CFM.daemon_socket)
+
+    if daemon: # a daemon has everything loaded already, let it do the work
+        requests = []
         if args.query or args.number_filter:
-            found = OPM.query_plugins(args.query, args.number_filter, args.sort)
+            requests.append({"cmd": "query", "query": args.query, "number_filter": args.number_filter, "sort": args.sort, "top": args.top})
+        for cmd, query in (("install", args.install), ("remove", args.remove), ("rollback", args.rollback)):
+            if query:
+                requests.append({"cmd": cmd, "query": query, "target": args.target})
+        if args.update:
+            requests.append({"cmd": "update", "target": args.target})
+        with daemon:
+            for daemon_request in requests:
+                response = PluginDaemon.send(daemon, daemon_request)
+                print(response.get("output", ""), end="")
+                if not response.get("ok"):
+                    print(f"Daemon request {daemon_request['cmd']} failed: {response.get('error')}")
+                elif "plugins" in response:
+                    OBSPluginManager(CFM, False).plugins_print(response["plugins"])
+
+    elif plugin_args: # if these args are set the plugin manager needs to run
+
+        online_args = any([args.query, args.install, args.update, args.number_filter])
+        OPM = OBSPluginManager(CFM, online_args) # update online index if needed, rollbacks stay offline
+
+        if args.query or args.number_filter:
+            found = OPM.query_plugins(args.query, args.number_filter, args.sort, args.top)
             OPM.plugins_print(found)
             #pass # send command to search for plugin
             # here we use all the list items and
             # only return a result if all of terms are in the result
 
+        targets = CFM.install_paths(args.target)
+
         if args.install:
-            OPM.download_plugins(args.install)
+            OPM.download_plugins(args.install, targets)
 
-        for plugin in args.remove:
-            pass # send command to remove plugin here
+        if args.remove:
+            OPM.remove_plugins(args.remove, targets if args.target else None)
 
         if args.update:
-            OPM.update_installed_plugins() # send command to update all
+            OPM.update_installed_plugins(targets if args.target else None) # send command to update all
+
+        if args.rollback:
+            OPM.rollback_plugins(args.rollback, targets if args.target else None)
+
+    if args.mirror_serve:
+        CatalogMirror(CFM).serve(args.mirror_serve, args.mirror_port)
 
+    if args.serve:
+        PluginDaemon(CFM).serve()